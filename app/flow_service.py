@@ -5,7 +5,10 @@
 from __future__ import annotations
 
 import time
+from collections import deque
 from typing import Optional
+
+import orjson
 from pydantic import BaseModel
 
 from .logging_loki import loki
@@ -25,7 +28,7 @@ class FlowServiceResult(BaseModel):
 # Main Flow Service Logic
 # ------------------------------------------------------
 
-def run_flow(
+async def run_flow(
     intent: str,
     text: str,
     user_id: str,
@@ -60,69 +63,78 @@ def run_flow(
     )
 
     # ======================================================
-    #  INTENT → FLOW ROUTING
+    #  INTENT → FLOW ROUTING (dict dispatch, O(1) as intents grow)
     # ======================================================
 
-    # 1. MENU FLOW
-    if intent == "menu":
-        start = time.perf_counter()
-
-        loki.log(
-            "info",
-            {
-                "event_type": "flow_menu_call",
-                "intent": intent,
-                "user": user_id,
-                "channel": channel,
-                "session_id": session_id,
-                "message": "calling menu_service",
-            },
-            service_type="flow_service",
-            sync_mode="async",
-            io="out",
-        )
+    handler = _FLOW_HANDLERS.get(intent, _handle_fallback)
+    return await handler(intent, text, user_id, channel, session_id)
 
-        # Call external microservice
-        menu_payload = fetch_menu(
-            user_id=user_id,
-            channel=channel,
-            session_id=session_id,
-        )
 
-        latency_ms = round((time.perf_counter() - start) * 1000.0, 3)
-
-        # Extract human-readable menu
-        reply_text = _extract_menu_text(menu_payload)
-
-        # Log return from menu_service
-        loki.log(
-            "info",
-            {
-                "event_type": "flow_menu_return",
-                "intent": intent,
-                "latency_ms": latency_ms,
-                "user": user_id,
-                "channel": channel,
-                "session_id": session_id,
-                "payload_received": True,
-            },
-            service_type="flow_service",
-            sync_mode="async",
-            io="in",
-        )
+# ------------------------------------------------------
+# Flow handlers
+# ------------------------------------------------------
+
+async def _handle_menu(
+    intent: str, text: str, user_id: str, channel: str, session_id: str
+) -> FlowServiceResult:
+    start_ns = time.perf_counter_ns()
+
+    loki.log(
+        "info",
+        {
+            "event_type": "flow_menu_call",
+            "intent": intent,
+            "user": user_id,
+            "channel": channel,
+            "session_id": session_id,
+            "message": "calling menu_service",
+        },
+        service_type="flow_service",
+        sync_mode="async",
+        io="out",
+    )
 
-        if not reply_text:
-            reply_text = (
-                "I tried to fetch the menu but didn't receive any usable data. "
-                "Please try again in a moment."
-            )
+    # Call external microservice
+    menu_payload = await fetch_menu(
+        user_id=user_id,
+        channel=channel,
+        session_id=session_id,
+    )
 
-        return FlowServiceResult(reply_text=reply_text, route="menu")
+    latency_ms = (time.perf_counter_ns() - start_ns) // 1_000 / 1_000
 
-    # ======================================================
-    #  UNKNOWN / DEFAULT FLOW
-    # ======================================================
+    # Extract human-readable menu
+    reply_text = _extract_menu_text_cached(menu_payload)
 
+    # Log return from menu_service
+    loki.log(
+        "info",
+        {
+            "event_type": "flow_menu_return",
+            "intent": intent,
+            "latency_ms": latency_ms,
+            "user": user_id,
+            "channel": channel,
+            "session_id": session_id,
+            "payload_received": True,
+        },
+        service_type="flow_service",
+        sync_mode="async",
+        io="in",
+    )
+
+    if not reply_text:
+        reply_text = (
+            "I tried to fetch the menu but didn't receive any usable data. "
+            "Please try again in a moment."
+        )
+
+    return FlowServiceResult.model_construct(reply_text=reply_text, route="menu")
+
+
+async def _handle_fallback(
+    intent: str, text: str, user_id: str, channel: str, session_id: str
+) -> FlowServiceResult:
     reply_text = (
         "I can help you by getting the menu. "
         "Try saying something like: 'Get the menu'.\n\n"
@@ -143,13 +155,62 @@ def run_flow(
         io="none",
     )
 
-    return FlowServiceResult(reply_text=reply_text, route="fallback")
+    return FlowServiceResult.model_construct(reply_text=reply_text, route="fallback")
+
+
+# Intent → handler table. New flows register here instead of growing an
+# if/elif chain inside run_flow.
+_FLOW_HANDLERS = {
+    "menu": _handle_menu,
+}
 
 
 # ------------------------------------------------------
 # Helper: Convert menu_payload into readable text
 # ------------------------------------------------------
 
+# extract_menu_text is deterministic, and the menu payload barely changes
+# between requests — cache the rendered text by payload hash so repeat
+# menu turns skip the whole walk/format step.
+MENU_TEXT_CACHE_TTL = 30.0
+MENU_TEXT_CACHE_MAX = 64
+
+_menu_text_cache: dict = {}  # payload hash -> (expires_at, text)
+
+
+def _extract_menu_text_cached(menu_payload: dict) -> str:
+    try:
+        key = hash(orjson.dumps(menu_payload, option=orjson.OPT_SORT_KEYS))
+    except (TypeError, orjson.JSONEncodeError):
+        return _extract_menu_text(menu_payload)
+
+    now = time.monotonic()
+    entry = _menu_text_cache.get(key)
+    if entry is not None and now < entry[0]:
+        return entry[1]
+
+    text = _extract_menu_text(menu_payload)
+    if len(_menu_text_cache) >= MENU_TEXT_CACHE_MAX:
+        _menu_text_cache.clear()
+    _menu_text_cache[key] = (now + MENU_TEXT_CACHE_TTL, text)
+    return text
+
+
+# Candidate keys for the structured-categories shapes n8n has been seen to
+# emit. _first stops on the first hit instead of chaining .get() fallbacks.
+_CAT_KEYS = ("categories", "data", "menu_items", "items")
+_ITEM_KEYS = ("items", "products", "dishes")
+_NAME_KEYS = ("name", "title")
+
+
+def _first(d: dict, keys: tuple, default=None):
+    for k in keys:
+        v = d.get(k)
+        if v is not None:
+            return v
+    return default
+
+
 def _extract_menu_text(menu_payload: dict) -> str:
     """Reusable version of menu formatting."""
 
@@ -165,26 +226,82 @@ def _extract_menu_text(menu_payload: dict) -> str:
         return menu_payload["menu"].strip()
 
     # Structured category list
-    if "categories" in menu_payload:
+    categories = _first(menu_payload, _CAT_KEYS)
+    if isinstance(categories, list):
         try:
-            lines = []
-            for c in menu_payload["categories"]:
+            # Seed the header so the whole reply is one final join — no
+            # per-line f-string formatting and no extra concat at the end.
+            lines = ["Here is the menu:"]
+            for c in categories:
                 if not isinstance(c, dict):
                     continue
-                name = c.get("name", "Category")
-                items = c.get("items") or []
+                name = _first(c, _NAME_KEYS, "Category")
+                items = _first(c, _ITEM_KEYS) or []
+                # List comprehension, not a generator: str.join fast-paths
+                # list inputs (single length pre-pass, no generator sends).
                 item_names = ", ".join(
-                    i.get("name", "") for i in items if isinstance(i, dict)
+                    [_first(i, _NAME_KEYS, "") for i in items if isinstance(i, dict)]
                 )
                 if item_names:
-                    lines.append(f"{name}: {item_names}")
+                    lines.append(name + ": " + item_names)
                 else:
                     lines.append(name)
 
-            if lines:
-                return "Here is the menu:\n" + "\n".join(lines)
+            if len(lines) > 1:
+                return "\n".join(lines)
 
         except Exception:
             return ""
 
+    # Last resort: deep-scan unknown n8n shapes for an "output" string,
+    # then fall back to the longest string anywhere in the payload (only
+    # if it's substantial enough to plausibly be menu text).
+    found = _find_output_str(menu_payload)
+    if found is not None:
+        return found.strip()
+
+    longest = _longest_string(menu_payload)
+    if len(longest) >= 20:
+        return longest.strip()
+
     return ""
+
+
+def _find_output_str(root) -> Optional[str]:
+    """Find the first string under an "output" key anywhere in the payload.
+
+    Iterative on purpose: an explicit stack avoids per-level function-call
+    overhead and the recursion limit on deeply nested webhook responses.
+    """
+    stack = deque([root])
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            v = obj.get("output") or obj.get("Output")
+            if isinstance(v, str):
+                return v
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return None
+
+
+def _longest_string(root) -> str:
+    """Longest string anywhere in the payload, tracked in place.
+
+    Iterative with exact-type checks: no recursion, no per-level list
+    allocations — just one work-stack and the current best.
+    """
+    stack = deque([root])
+    best = ""
+    while stack:
+        node = stack.pop()
+        t = type(node)
+        if t is str:
+            if len(node) > len(best):
+                best = node
+        elif t is dict:
+            stack.extend(node.values())
+        elif t is list:
+            stack.extend(node)
+    return best
@@ -1,9 +1,51 @@
 #loki sync i/o
 
+import gzip
+import hashlib
 import os
+import queue
+import threading
 import time
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Flusher tuning: one Loki push per ≤500 entries or 500 ms, whichever first.
+FLUSH_INTERVAL_S = 0.5
+FLUSH_MAX_ENTRIES = 500
+QUEUE_MAXSIZE = 10_000
+
+# Only low-cardinality keys may become Loki stream labels. High-cardinality
+# values (session_id, user, text, ...) stay in the JSON line: every unique
+# label combination creates a new Loki stream, and unbounded streams are
+# Loki's #1 documented anti-pattern.
+_LABEL_ALLOW = frozenset(
+    {"app", "level", "event", "service", "flow", "step", "intent", "outcome", "mode", "io"}
+)
+
+# Severity ranking for the LOKI_MIN_LEVEL filter. Unknown levels rank as
+# info so a typo'd level is shipped rather than silently dropped.
+_LEVEL_RANK = {"debug": 10, "info": 20, "warning": 30, "error": 40, "critical": 50}
+
+# Longest user-supplied text embedded verbatim in a log line. Anything
+# longer is truncated (orjson.dumps and Loki ingest bytes scale with
+# message size) and accompanied by a short digest for correlation.
+LOG_TEXT_MAX = 512
+
+
+def clip_text(text: str):
+    """Bound user text for log payloads.
+
+    Returns (text, None) when it fits within LOG_TEXT_MAX, otherwise a
+    truncated copy plus a short blake2b digest of the full text so long
+    messages stay correlatable across log lines.
+    """
+    if len(text) <= LOG_TEXT_MAX:
+        return text, None
+    digest = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+    return text[: LOG_TEXT_MAX - 3] + "...", digest
 
 
 class LokiLogger:
@@ -29,6 +71,19 @@ class LokiLogger:
       - io           (in / out)
     """
 
+    __slots__ = (
+        "url",
+        "username",
+        "token",
+        "app_label",
+        "enabled",
+        "min_rank",
+        "dropped",
+        "_session",
+        "_q",
+        "_flusher",
+    )
+
     def __init__(self) -> None:
         self.url = os.getenv("GRAFANA_LOKI_URL")
         self.username = os.getenv("GRAFANA_LOKI_USERNAME")
@@ -36,10 +91,44 @@ class LokiLogger:
         self.app_label = os.getenv("MCP_APP_LABEL", "mcp_orchestrator_sync")
 
         self.enabled = all([self.url, self.username, self.token])
+        self.min_rank = _LEVEL_RANK.get(
+            os.getenv("LOKI_MIN_LEVEL", "info").lower(), _LEVEL_RANK["info"]
+        )
+        self.dropped = 0
         if not self.enabled:
             print("[LokiLogger] Disabled – missing GRAFANA_LOKI_* env vars")
         else:
             print("[LokiLogger] Enabled, pushing to", self.url)
+            # Keep-alive session: reuse the TCP/TLS connection to grafana.net
+            # instead of paying a full handshake per push.
+            self._session = requests.Session()
+            self._session.auth = (self.username, self.token)
+            self._session.headers["Content-Type"] = "application/json"
+            # Every push body is gzipped in _push_batch.
+            self._session.headers["Content-Encoding"] = "gzip"
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=32,
+                max_retries=Retry(
+                    total=2,
+                    backoff_factor=0.1,
+                    status_forcelist=[502, 503, 504],
+                    # urllib3's default allowed_methods excludes POST, which
+                    # would make the status_forcelist inert for pushes.
+                    # Retrying is safe: the body is a replayable bytes
+                    # object and Loki dedupes identical entries.
+                    allowed_methods=None,
+                ),
+            )
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+            # Log lines are queued here and shipped by a single background
+            # thread, so the request path never waits on a Loki round-trip.
+            self._q: queue.Queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="loki-flusher", daemon=True
+            )
+            self._flusher.start()
 
     # ----------------- internal helpers -----------------
 
@@ -74,57 +163,106 @@ class LokiLogger:
             if val not in (None, "", []):
                 labels[dst] = str(val)
 
-        return labels
+        # Defensive: never let a future mapping change leak an unbounded
+        # label (session_id, user, ...) into the stream set.
+        return {k: v for k, v in labels.items() if k in _LABEL_ALLOW}
+
+    def _flush_loop(self) -> None:
+        """Drain the queue in batches and push each batch as one request."""
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL_S
+            while len(batch) < FLUSH_MAX_ENTRIES:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._push_batch(batch)
+
+    def _push_batch(self, batch: list) -> None:
+        """Group queued entries by stream labels and POST one Loki body."""
+        streams: dict = {}
+        for ts_ns, stream_labels, line in batch:
+            key = tuple(sorted(stream_labels.items()))
+            entry = streams.get(key)
+            if entry is None:
+                entry = streams[key] = {"stream": stream_labels, "values": []}
+            entry["values"].append([str(ts_ns), line])
+
+        # level 1 is plenty for repetitive JSON and keeps CPU cost negligible.
+        body = gzip.compress(
+            orjson.dumps({"streams": list(streams.values())}), compresslevel=1
+        )
+
+        try:
+            resp = self._session.post(
+                self.url,
+                data=body,
+                timeout=(1.0, 3.0),
+            )
+            if resp.status_code not in (200, 204):
+                print(
+                    "[LokiLogger] Push failed:",
+                    resp.status_code,
+                    resp.text[:200],
+                )
+        except Exception as e:
+            print("[LokiLogger] Exception while pushing to Loki:", e)
 
     # ----------------- public API -----------------
 
-    def log(self, level: str, message, **fields) -> None:
+    def enabled_for(self, level: str) -> bool:
+        """Cheap pre-check so hot paths can skip building the payload dict
+        entirely when Loki is off or the level is filtered out."""
+        return self.enabled and _LEVEL_RANK.get(level, 20) >= self.min_rank
+
+    def log(self, level: str, message, ts_ns: int = None, **fields) -> None:
         """
         Main logging function used by the rest of the app.
 
+        Non-blocking: it only serializes the line and enqueues it for the
+        background flusher, so it is safe to call from async handlers
+        without stalling the event loop.
+
         level   : "info", "warning", "error", etc.
         message : str OR dict
+        ts_ns   : optional precomputed time.time_ns() — callers emitting
+                  several lines per request can share one clock read
         fields  : extra context: event, flow, step, service_type,
                   session_id, sync_mode, io, etc.
         """
-        if not self.enabled:
+        if not self.enabled_for(level):
             return
 
+        # `fields` is already a fresh kwargs dict owned by this call, so
+        # mutate it in place instead of merging into yet another dict.
         if isinstance(message, dict):
-            payload_fields = {**fields, **message}
+            fields.update(message)
         else:
-            payload_fields = {**fields, "message": str(message)}
+            fields["message"] = str(message)
+        payload_fields = fields
 
-        ts_ns = int(time.time() * 1_000_000_000)  # nanoseconds
+        if ts_ns is None:
+            ts_ns = time.time_ns()  # nanoseconds, without float precision loss
 
         stream_labels = self._build_stream_labels(level, payload_fields)
-
-        body = {
-            "streams": [
-                {
-                    "stream": stream_labels,
-                    "values": [
-                        [str(ts_ns), json.dumps(payload_fields, ensure_ascii=False)]
-                    ],
-                }
-            ]
-        }
+        # orjson returns bytes; Loki wants the log line as a string.
+        line = orjson.dumps(payload_fields).decode()
 
         try:
-            resp = requests.post(
-                self.url,
-                auth=(self.username, self.token),
-                json=body,
-                timeout=4,
-            )
-            if resp.status_code not in (200, 204):
-                print(
-                    "[LokiLogger] Push failed:",
-                    resp.status_code,
-                    resp.text[:200],
-                )
-        except Exception as e:
-            print("[LokiLogger] Exception while pushing to Loki:", e)
+            self._q.put_nowait((ts_ns, stream_labels, line))
+        except queue.Full:
+            # Never block the request path on a slow Loki: drop the oldest
+            # entry (freshest data wins) and count the loss.
+            self.dropped += 1
+            try:
+                self._q.get_nowait()
+                self._q.put_nowait((ts_ns, stream_labels, line))
+            except (queue.Empty, queue.Full):
+                pass
 
 
 # Global logger used by main.py
@@ -3,15 +3,27 @@
 # app/main.py
 from __future__ import annotations
 
+import asyncio
+import os
 import time
-from datetime import datetime, timezone
-from typing import Dict, Optional
-
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-
-from .logging_loki import loki
-from .intent_service import classify_intent
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from pydantic import BaseModel, ValidationError
+
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass  # fall back to the default asyncio loop
+
+from .logging_loki import clip_text, loki
+from .intent_service import classify_intent, close_http, start_dispatcher
+from .menu_service import close_http as close_menu_http, fetch_menu, start_batcher
 from .flow_service import run_flow   # ← NEW: flow microservice orchestrator
 
 
@@ -26,75 +38,212 @@ class OrchestrateRequest(BaseModel):
     session_id: Optional[str] = None
 
 
-class OrchestrateResponse(BaseModel):
-    decision: str
-    reply_text: str
-    session_id: str
-    route: str
-    intent: str
-    intent_confidence: float
+# Bound once so the hot path skips the classmethod lookup; Pydantic's Rust
+# core then parses bytes -> model in a single pass.
+_validate_orchestrate_request = OrchestrateRequest.model_validate_json
+
+
+# Response shape of /orchestrate (serialized straight from a dict by
+# ORJSONResponse — no response_model revalidation on the hot path):
+#   decision, reply_text, session_id, route, intent, intent_confidence
+
+
+# ------------------------------------------------------
+#  Prometheus Metrics
+# ------------------------------------------------------
+#
+# Buckets are tuned for an LLM-backed endpoint: default Histogram buckets
+# top out at 10 s, which would collapse the OpenAI tail into +Inf. Label
+# sets are precompiled once so the hot path only pays a dict lookup.
+
+REQUEST_LATENCY = Histogram(
+    "mcp_request_latency_seconds",
+    "End-to-end /orchestrate latency",
+    labelnames=("route", "outcome"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+REQUEST_COUNT = Counter(
+    "mcp_requests_total",
+    "Total /orchestrate requests",
+    labelnames=("route", "outcome"),
+)
 
 
 # ------------------------------------------------------
 #  Session State (thin)
 # ------------------------------------------------------
 
-class SessionState(BaseModel):
-    """Minimal session state — the flow microservice will hold domain logic."""
+@dataclass(slots=True)
+class SessionState:
+    """Minimal session state — the flow microservice will hold domain logic.
+
+    Pure in-process state that is never parsed from input, so it's a plain
+    slotted dataclass: no Pydantic validation on construction or mutation,
+    and no per-instance __dict__.
+    """
     turn_count: int = 0
-    last_active_at: Optional[datetime] = None
+    last_active_at: Optional[float] = None  # epoch seconds (time.time())
     last_route: Optional[str] = None
 
 
-SESSION_STORE: Dict[str, SessionState] = {}
+SESSION_STORE_MAX = int(os.getenv("SESSION_STORE_MAX", "10000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+
+
+class SessionStore:
+    """LRU + TTL bounded session map.
+
+    Every unique session_id used to leak a SessionState forever; now the
+    least-recently-used sessions are evicted once the store hits its cap,
+    and idle sessions expire after SESSION_TTL_S, which bounds RSS at any
+    load. No lock needed: the store is only touched from the event loop.
+    """
+
+    def __init__(
+        self, maxsize: int = SESSION_STORE_MAX, ttl: float = SESSION_TTL_S
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # session_id -> [expires_at, state]
+        self._store: OrderedDict[str, list] = OrderedDict()
+
+    def get_or_create(self, session_id: str) -> SessionState:
+        now = time.monotonic()
+        entry = self._store.get(session_id)
+        if entry is not None and now < entry[0]:
+            entry[0] = now + self.ttl
+            self._store.move_to_end(session_id)
+            return entry[1]
+
+        state = SessionState()
+        self._store[session_id] = [now + self.ttl, state]
+        self._store.move_to_end(session_id)
+        while len(self._store) > self.maxsize:
+            self._store.popitem(last=False)
+        return state
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+SESSION_STORE = SessionStore()
+
+# Speculative menu prefetch: kick off fetch_menu in parallel with the LLM
+# intent call, so on menu-heavy traffic the two RTTs overlap instead of
+# serializing. Wasted fetches on the fallback path are bounded by the menu
+# cache + per-channel single-flight in menu_service, but it's still opt-in.
+SPECULATE_MENU = os.getenv("SPECULATE_MENU", "0") == "1"
+
+# Constant keyword sets for this module's loki.log calls, built once at
+# import and expanded with ** per call — handlers no longer rebuild the
+# same three-literal dicts on every request.
+_ORCH_IN_KW = dict(service_type="orchestrator", sync_mode="sync", io="in")
+_ORCH_OUT_KW = dict(service_type="orchestrator", sync_mode="sync", io="out")
+_ORCH_NONE_KW = dict(service_type="orchestrator", sync_mode="sync", io="none")
+
+
+def _reap_task(task: asyncio.Task) -> None:
+    """Retrieve the result of a fire-and-forget task so a failed or
+    cancelled speculative fetch never logs an 'exception never retrieved'
+    warning."""
+    if not task.cancelled():
+        task.exception()
 
 
 def get_session(session_id: str) -> SessionState:
-    if session_id not in SESSION_STORE:
-        SESSION_STORE[session_id] = SessionState()
-    return SESSION_STORE[session_id]
+    return SESSION_STORE.get_or_create(session_id)
 
 
 # ------------------------------------------------------
 #  FastAPI App
 # ------------------------------------------------------
 
-app = FastAPI(title="MCP Orchestrator – Ultra Thin (Intent + Flow Service)")
+app = FastAPI(
+    title="MCP Orchestrator – Ultra Thin (Intent + Flow Service)",
+    default_response_class=ORJSONResponse,
+)
+
+
+@app.on_event("startup")
+async def _startup() -> None:
+    start_dispatcher()
+    start_batcher()
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await close_http()
+    await close_menu_http()
 
 
 @app.get("/health")
-def health_check():
-    loki.log(
-        "info",
-        {"event_type": "health"},
-        service_type="orchestrator",
-        sync_mode="sync",
-        io="none",
-    )
+async def health_check():
+    loki.log("info", {"event_type": "health"}, **_ORCH_NONE_KW)
     return {"status": "ok", "service": "mcp_orchestrator_thin"}
 
 
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # ------------------------------------------------------
 #  MAIN ORCHESTRATION ENDPOINT
 # ------------------------------------------------------
 
-@app.post("/orchestrate", response_model=OrchestrateResponse)
-def orchestrate(req: OrchestrateRequest):
+@app.post("/orchestrate")
+async def orchestrate(request: Request):
+
+    start_ns = time.perf_counter_ns()
+    # One wall-clock read per request: session bookkeeping and every log
+    # line emitted from this handler share it (same timestamp also makes
+    # the lines trivially correlated in Loki).
+    now_ns = time.time_ns()
 
-    start = time.perf_counter()
+    # Single-pass parse + validate straight from the raw bytes (Pydantic v2
+    # uses jiter under the hood), instead of FastAPI's json.loads-then-
+    # validate double parse.
+    try:
+        # strict=True keeps pydantic-core on its fast exact-type path (and
+        # rejects silent coercions like numeric user_ids).
+        req = _validate_orchestrate_request(await request.body(), strict=True)
+    except ValidationError as e:
+        # include_input=False: json_invalid errors embed the raw request
+        # bytes under 'input', which the HTTP exception handler can't
+        # JSON-serialize (a malformed body would 500 instead of 422).
+        raise HTTPException(
+            status_code=422,
+            detail=e.errors(include_url=False, include_input=False),
+        )
 
     # ------------------------------
     #  SESSION MANAGEMENT
     # ------------------------------
-    session_id = req.session_id or f"{req.user_id}:{req.channel}"
+    session_id = req.session_id
+    if not session_id:
+        session_id = req.user_id + ":" + req.channel
     state = get_session(session_id)
     state.turn_count += 1
-    state.last_active_at = datetime.now(timezone.utc)
+    state.last_active_at = now_ns / 1e9
 
     # ------------------------------
     #  INTENT CLASSIFICATION (LLM)
     # ------------------------------
-    intent_result = classify_intent(
+    # Speculatively warm the menu while the LLM decides: if the intent
+    # comes back "menu", run_flow's fetch_menu joins this in-flight call
+    # (single-flight) or hits the fresh cache entry.
+    menu_task: Optional[asyncio.Task] = None
+    if SPECULATE_MENU:
+        menu_task = asyncio.create_task(
+            fetch_menu(
+                user_id=req.user_id,
+                channel=req.channel,
+                session_id=session_id,
+            )
+        )
+        menu_task.add_done_callback(_reap_task)
+
+    intent_result = await classify_intent(
         text=req.text,
         user_id=req.user_id,
         channel=req.channel,
@@ -104,12 +253,19 @@ def orchestrate(req: OrchestrateRequest):
     intent = intent_result.intent
     confidence = intent_result.confidence
 
+    # Wrong guess: stop the speculative fetch instead of finishing a
+    # round-trip nobody will read.
+    if menu_task is not None and intent != "menu":
+        menu_task.cancel()
+
     # ------------------------------
     #  LOG INPUT EVENT
     # ------------------------------
-    loki.log(
-        "info",
-        {
+    # enabled_for gate first: when Loki is off or info is filtered, the
+    # ~10-key payload dict (including the full text copy) is never built.
+    if loki.enabled_for("info"):
+        text_field, text_hash = clip_text(req.text)
+        payload = {
             "event_type": "input",
             "user": req.user_id,
             "channel": req.channel,
@@ -117,18 +273,17 @@ def orchestrate(req: OrchestrateRequest):
             "turn": state.turn_count,
             "intent": intent,
             "intent_confidence": confidence,
-            "text": req.text,
-        },
-        service_type="orchestrator",
-        sync_mode="sync",
-        io="in",
-    )
+            "text": text_field,
+        }
+        if text_hash is not None:
+            payload["text_hash"] = text_hash
+        loki.log("info", payload, ts_ns=now_ns, **_ORCH_IN_KW)
 
     # ------------------------------
     #  FLOW SERVICE (Domain Logic)
     # ------------------------------
     try:
-        flow_result = run_flow(
+        flow_result = await run_flow(
             intent=intent,
             text=req.text,
             user_id=req.user_id,
@@ -139,41 +294,53 @@ def orchestrate(req: OrchestrateRequest):
         reply_text = flow_result.reply_text
         route = flow_result.route
 
-        latency_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        # Integer ns diff, truncated to µs, then one division: exact 3-decimal
+        # ms without the slow round() builtin or float subtraction drift.
+        latency_ms = (time.perf_counter_ns() - start_ns) // 1_000 / 1_000
+
+        REQUEST_LATENCY.labels(route, "ok").observe(latency_ms / 1000.0)
+        REQUEST_COUNT.labels(route, "ok").inc()
 
         # ------------------------------
         #  LOG OUTPUT EVENT
         # ------------------------------
-        loki.log(
-            "info",
-            {
-                "event_type": "output",
-                "user": req.user_id,
-                "channel": req.channel,
-                "session_id": session_id,
-                "turn": state.turn_count,
-                "latency_ms": latency_ms,
-                "route": route,
-                "intent": intent,
-                "intent_confidence": confidence,
-                "message": "request_end",
-            },
-            service_type="orchestrator",
-            sync_mode="sync",
-            io="out",
-        )
-
-        return OrchestrateResponse(
-            decision="reply",
-            reply_text=reply_text,
-            session_id=session_id,
-            route=route,
-            intent=intent,
-            intent_confidence=confidence,
-        )
+        if loki.enabled_for("info"):
+            loki.log(
+                "info",
+                {
+                    "event_type": "output",
+                    "user": req.user_id,
+                    "channel": req.channel,
+                    "session_id": session_id,
+                    "turn": state.turn_count,
+                    "latency_ms": latency_ms,
+                    "route": route,
+                    "intent": intent,
+                    "intent_confidence": confidence,
+                    "message": "request_end",
+                },
+                ts_ns=now_ns,
+                **_ORCH_OUT_KW,
+            )
+
+        # Trusted internal values — plain dict straight into ORJSONResponse,
+        # no model construction or response revalidation.
+        return {
+            "decision": "reply",
+            "reply_text": reply_text,
+            "session_id": session_id,
+            "route": route,
+            "intent": intent,
+            "intent_confidence": confidence,
+        }
 
     except Exception as e:
-        latency_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        # Integer ns diff, truncated to µs, then one division: exact 3-decimal
+        # ms without the slow round() builtin or float subtraction drift.
+        latency_ms = (time.perf_counter_ns() - start_ns) // 1_000 / 1_000
+
+        REQUEST_LATENCY.labels("unknown", "error").observe(latency_ms / 1000.0)
+        REQUEST_COUNT.labels("unknown", "error").inc()
 
         # ------------------------------
         #  LOG ERROR EVENT
@@ -191,9 +358,8 @@ def orchestrate(req: OrchestrateRequest):
                 "intent_confidence": confidence,
                 "error": str(e),
             },
-            service_type="orchestrator",
-            sync_mode="sync",
-            io="none",
+            ts_ns=now_ns,
+            **_ORCH_NONE_KW,
         )
 
         raise HTTPException(status_code=500, detail="Internal error in orchestrator")
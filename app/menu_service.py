@@ -2,19 +2,192 @@
 
 # app/menu_service.py
 
+import asyncio
 import os
 import time
 from typing import Dict, Any
 
-import requests
+import httpx
+import orjson
 
 from .logging_loki import loki
 
 
 MENU_SERVICE_URL = os.getenv("MENU_SERVICE_URL")
 
+# Constant keyword sets for this module's loki.log calls, mirroring the
+# skeletons in main.py: built once, expanded with ** per call.
+_MENU_OUT_KW = dict(service_type="menu_service", sync_mode="async", io="out")
+_MENU_IN_KW = dict(service_type="menu_service", sync_mode="async", io="in")
+_MENU_NONE_KW = dict(service_type="menu_service", sync_mode="async", io="none")
 
-def fetch_menu(user_id: str, channel: str, session_id: str) -> Dict[str, Any]:
+# Debug-only log fields (e.g. the reflective raw_shape) cost allocations on
+# every successful fetch for a field nobody reads in steady state.
+_DEBUG = os.getenv("MENU_SERVICE_DEBUG") == "1"
+
+# Pre-parsed URL: httpx re-runs its URL parser on every request when handed
+# a str; the URL never changes, so parse it once at import.
+_MENU_URL = httpx.URL(MENU_SERVICE_URL) if MENU_SERVICE_URL else None
+
+# Module-level pooled async client: keep-alive connections mean each menu
+# fetch reuses an existing TCP+TLS connection instead of paying a fresh
+# handshake, and awaiting the call frees the event loop for other requests.
+_HTTP = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+)
+
+
+async def close_http() -> None:
+    """Close the shared HTTP pool. Call from FastAPI shutdown."""
+    await _HTTP.aclose()
+
+
+# ------------------------------------------------------
+# Coalescing batcher
+# ------------------------------------------------------
+#
+# Every "menu" turn used to fire its own webhook round-trip. The menu is
+# user-independent, and the n8n endpoint is a plain GET with no batch API,
+# so a "batch" here is simply: collect callers arriving within a short
+# window and serve them all from one upstream fetch.
+
+MENU_BATCH_WAIT_MS = float(os.getenv("MENU_BATCH_WAIT_MS", "10"))
+MENU_BATCH_MAX = int(os.getenv("MENU_BATCH_MAX", "32"))
+
+_batch_queue = None
+_batcher_task = None
+
+
+async def _batcher_loop() -> None:
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = time.monotonic() + MENU_BATCH_WAIT_MS / 1000.0
+        while len(batch) < MENU_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(_batch_queue.get(), timeout=remaining)
+                )
+            except asyncio.TimeoutError:
+                break
+
+        # Serve the batch in its own task so the drain loop goes straight
+        # back to the queue — a hung fetch (up to the 10 s timeout) must
+        # not block other channels' cold fetches queued behind it.
+        asyncio.create_task(_serve_batch(batch))
+
+
+async def _serve_batch(batch: list) -> None:
+    # One upstream fetch serves the whole batch; attribute it to the
+    # first caller for logging purposes.
+    user_id, channel, session_id, _ = batch[0]
+    try:
+        payload = await _fetch_menu_upstream(user_id, channel, session_id)
+    except Exception as e:  # pragma: no cover - upstream already guards
+        for _, _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    for _, _, _, future in batch:
+        if not future.done():
+            future.set_result(payload)
+
+
+def start_batcher() -> None:
+    """Start the menu coalescing batcher. Call once from FastAPI startup."""
+    global _batch_queue, _batcher_task
+    if _batcher_task is not None:
+        return
+    _batch_queue = asyncio.Queue()
+    _batcher_task = asyncio.create_task(_batcher_loop())
+
+
+# ------------------------------------------------------
+# TTL cache (per channel)
+# ------------------------------------------------------
+#
+# The menu rarely changes, so a short TTL turns the network-bound path into
+# a dict lookup for everything after the first cold fetch. Menus are shared
+# across users, so the key is just the channel. A per-channel lock keeps a
+# thundering herd down to one upstream call.
+#
+# Past the fresh TTL there is a stale-while-revalidate window: callers get
+# the stale copy instantly while one background task refreshes, so nobody
+# ever waits on the n8n round-trip unless the entry is truly ancient.
+
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "60"))
+MENU_CACHE_SWR = float(os.getenv("MENU_CACHE_SWR", "300"))
+
+_menu_cache: Dict[str, tuple] = {}  # channel -> (expires_at, payload)
+_menu_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _reap_task(task: asyncio.Task) -> None:
+    """Retrieve the result of a background refresh so a failed one never
+    logs an 'exception never retrieved' warning."""
+    if not task.cancelled():
+        task.exception()
+
+
+async def _refresh_menu(user_id: str, channel: str, session_id: str) -> None:
+    """Background refill for the stale-while-revalidate window."""
+    lock = _menu_locks.setdefault(channel, asyncio.Lock())
+    if lock.locked():  # someone is already refreshing this channel
+        return
+    async with lock:
+        payload = await _fetch_menu_coalesced(user_id, channel, session_id)
+        if payload:
+            _menu_cache[channel] = (time.monotonic() + MENU_CACHE_TTL, payload)
+
+
+async def fetch_menu(user_id: str, channel: str, session_id: str) -> Dict[str, Any]:
+    """Fetch the menu, caching per channel and coalescing concurrent callers."""
+    entry = _menu_cache.get(channel)
+    if entry is not None:
+        now = time.monotonic()
+        if now < entry[0]:
+            return entry[1]
+        if now < entry[0] + MENU_CACHE_SWR:
+            # Stale but serviceable: hand back the old copy and refresh
+            # off-path. The lock check inside _refresh_menu dedupes
+            # concurrent revalidations to one upstream call.
+            task = asyncio.create_task(
+                _refresh_menu(user_id, channel, session_id)
+            )
+            task.add_done_callback(_reap_task)
+            return entry[1]
+
+    lock = _menu_locks.setdefault(channel, asyncio.Lock())
+    async with lock:
+        # Re-check: another caller may have refilled while we waited.
+        entry = _menu_cache.get(channel)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+
+        payload = await _fetch_menu_coalesced(user_id, channel, session_id)
+        if payload:  # never cache a failed/empty fetch
+            _menu_cache[channel] = (time.monotonic() + MENU_CACHE_TTL, payload)
+        return payload
+
+
+async def _fetch_menu_coalesced(
+    user_id: str, channel: str, session_id: str
+) -> Dict[str, Any]:
+    """Route a fetch through the batcher (or directly if not started)."""
+    if _batch_queue is None:
+        return await _fetch_menu_upstream(user_id, channel, session_id)
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    _batch_queue.put_nowait((user_id, channel, session_id, future))
+    return await future
+
+
+async def _fetch_menu_upstream(
+    user_id: str, channel: str, session_id: str
+) -> Dict[str, Any]:
     """
     Fetch the restaurant menu from an external service (n8n webhook).
 
@@ -43,80 +216,71 @@ def fetch_menu(user_id: str, channel: str, session_id: str) -> Dict[str, Any]:
                 "channel": channel,
                 "session_id": session_id,
             },
-            service_type="menu_service",
-            sync_mode="async",
-            io="none",
+            **_MENU_NONE_KW,
         )
         return {}
 
-    start = time.perf_counter()
+    start_ns = time.perf_counter_ns()
 
     # ---- OUTGOING CALL LOG (async OUT) ----
-    loki.log(
-        "info",
-        {
-            "event_type": "service_call",
-            "reason": "get_menu",
-            "user": user_id,
-            "channel": channel,
-            "session_id": session_id,
-        },
-        service_type="menu_service",
-        sync_mode="async",
-        io="out",
-    )
+    # enabled_for gate keeps the payload dicts from being built at all
+    # when Loki is off or info is filtered (same idiom as main.py).
+    info_logging = loki.enabled_for("info")
+    if info_logging:
+        loki.log(
+            "info",
+            {
+                "event_type": "service_call",
+                "reason": "get_menu",
+                "user": user_id,
+                "channel": channel,
+                "session_id": session_id,
+            },
+            **_MENU_OUT_KW,
+        )
 
     try:
-        resp = requests.get(MENU_SERVICE_URL, timeout=10.0)
+        resp = await _HTTP.get(_MENU_URL)
         resp.raise_for_status()
-        data = resp.json()
-
-        # --- NORMALIZATION STEP ---
-
-        # If it's a list, take the first element
-        if isinstance(data, list) and data:
-            first = data[0]
-        else:
-            first = data
-
-        # Expect dict with "output"
-        if isinstance(first, dict):
-            out = first.get("output")
-        else:
-            out = None
-
-        # If output is an object with "text", flatten it
-        if isinstance(out, dict) and isinstance(out.get("text"), str):
-            normalized = {"output": out["text"]}
-        # If output is already a string, just pass it through
-        elif isinstance(out, str):
-            normalized = {"output": out}
-        else:
-            # Unknown shape – log and treat as empty
+        # orjson over resp.json(): httpx decodes via stdlib json, which is
+        # several times slower on the larger menu payloads. Only runs on
+        # cache misses, but those cluster at cold start.
+        data = orjson.loads(resp.content)
+
+        # --- NORMALIZATION STEP (EAFP) ---
+        # Optimistically index the two known n8n shapes —
+        # [{"output": {"text": ...}}] and [{"output": "..."}] — and let the
+        # except clause absorb everything else. The happy path is a couple
+        # of subscripts instead of the old isinstance ladder; unknown
+        # shapes still normalize to {}.
+        try:
+            first = data[0] if isinstance(data, list) else data
+            out = first["output"]
+            if isinstance(out, dict):
+                out = out["text"]
+            normalized = {"output": out} if isinstance(out, str) else {}
+        except (KeyError, TypeError, IndexError):
             normalized = {}
 
-        latency_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        latency_ms = (time.perf_counter_ns() - start_ns) // 1_000 / 1_000
 
         # ---- INCOMING RESPONSE LOG (async IN) ----
-        loki.log(
-            "info",
-            {
+        if info_logging:
+            payload = {
                 "event_type": "service_return",
                 "user": user_id,
                 "channel": channel,
                 "session_id": session_id,
                 "latency_ms": latency_ms,
-                "raw_shape": type(data).__name__,
-            },
-            service_type="menu_service",
-            sync_mode="async",
-            io="in",
-        )
+            }
+            if _DEBUG:
+                payload["raw_shape"] = type(data).__name__
+            loki.log("info", payload, **_MENU_IN_KW)
 
         return normalized
 
     except Exception as e:
-        latency_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        latency_ms = (time.perf_counter_ns() - start_ns) // 1_000 / 1_000
         loki.log(
             "error",
             {
@@ -127,8 +291,6 @@ def fetch_menu(user_id: str, channel: str, session_id: str) -> Dict[str, Any]:
                 "latency_ms": latency_ms,
                 "error": str(e),
             },
-            service_type="menu_service",
-            sync_mode="async",
-            io="none",
+            **_MENU_NONE_KW,
         )
         return {}